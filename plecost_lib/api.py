@@ -67,8 +67,8 @@ def run(config):
     # --------------------------------------------------------------------------
     # Checks Python version
     # --------------------------------------------------------------------------
-    if version_info < (3, 3):
-        raise RuntimeError("You need Python 3.3.x or higher to run Plecost")
+    if version_info < (3, 5):
+        raise RuntimeError("You need Python 3.5.x or higher to run Plecost")
 
     # Check reporter
     if config.report_filename is not None:
@@ -218,7 +218,7 @@ def update_progress(values, print_function=None, prefix_text="", bar_len=40):
 # ------------------------------------------------------------------------------
 @asyncio.coroutine
 def download(url, max_tries=3, max_redirect=2, connector=None, loop=None, method="get", get_content=True,
-             auto_redirect=True):
+             auto_redirect=True, headers=None, decode=True, timeout=None):
     """
     Download a web page content.
 
@@ -240,29 +240,51 @@ def download(url, max_tries=3, max_redirect=2, connector=None, loop=None, method
     :param get_content: boolean value that indicates if must download content or not
     :type get_content: bool
 
+    :param headers: extra HTTP headers to send
+    :type headers: dict
+
+    :param decode: boolean value that indicates if content must be decoded to str or returned as raw bytes
+    :type decode: bool
+
+    :param timeout: seconds to wait for each try, body included. None means no limit. The worst case for a
+                    download is max_tries * timeout seconds.
+    :type timeout: float
+
     :return: Web page content as a tuple: (http_header, status, basestring)
-    :rtype: (dict, int, str)
+    :rtype: (dict, int, str|bytes)
     """
     _loop = loop or asyncio.get_event_loop()
 
     if max_redirect < 0:
         return None, None, None
 
+    @asyncio.coroutine
+    def _fetch():
+        _response = yield from aiohttp.request(
+            # 'get',
+            method,
+            url,
+            headers=headers,
+            connector=connector,
+            allow_redirects=False,
+            loop=_loop)
+
+        # Body is read into the same try, so the timeout covers it too
+        _body = None
+        if get_content and _response.status not in (300, 301, 302, 303, 307):
+            _body = yield from _response.read()
+
+        return _response, _body
+
     tries = 0
 
     while tries < max_tries:
         try:
-            response = yield from aiohttp.request(
-                # 'get',
-                method,
-                url,
-                connector=connector,
-                allow_redirects=False,
-                loop=_loop)
+            response, content = yield from asyncio.wait_for(_fetch(), timeout)
             if tries > 1:
                 log('\n[!] try %r for %r success\n', tries, url)
             break
-        except aiohttp.ClientError as client_error:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as client_error:
             log("\n[!] Can't get before %r for %r tries, raised %r\n" % (
                 colorize(tries, "red"), colorize(url, "red"), client_error),
                 log_level=3)
@@ -287,10 +309,8 @@ def download(url, max_tries=3, max_redirect=2, connector=None, loop=None, method
             log('\n[!] redirect limit reached for %r from %r\n' % (next_url, url), log_level=2)
             return response.headers, response.status, None
     else:
-        content = None
-
-        if get_content:
-            content = (yield from response.read()).decode(errors="ignore")
+        if content is not None and decode:
+            content = content.decode(errors="ignore")
 
         return response.headers, response.status, content
 
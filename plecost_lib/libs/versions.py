@@ -54,6 +54,10 @@ from .plugins_utils import plugins_testing
 from .utils import colorize, generate_error_page, download, get_data_folder
 from .wordpress_core import is_remote_a_wordpress, get_wordpress_version, get_wordpress_vulnerabilities
 
+# ANSI codes around red text, computed once, so CVE rows don't need a colorize call each
+_RED_ON, _, _RED_OFF = colorize("\x00", "red").partition("\x00")
+_CVE_LINE = "    |__" + _RED_ON + "{0}" + _RED_OFF + ": (http://cve.mitre.org/cgi-bin/cvename.cgi?name={0})\n"
+
 
 # ----------------------------------------------------------------------
 # Main code of functions
@@ -103,7 +107,12 @@ def find_versions(args):
     # Test availability of target
     # --------------------------------------------------------------------------
     log("[*] Testing target connection...")
-    headers, status, content = loop.run_until_complete(_download(url, method="get", get_content=False))
+    # Keep the home page only if WordPress detection or version checks will reuse it
+    need_homepage = no_check_wordpress is False or no_check_wordpress_version is False
+    headers, status, content = loop.run_until_complete(_download(url, method="get", get_content=need_homepage,
+                                                                 decode=False))
+
+    homepage = content if status == 200 else None
 
     # Detect redirect
     if status in (300, 301, 302, 303, 307):
@@ -124,7 +133,9 @@ def find_versions(args):
             # Error page content.
             headers, status, error_page = loop.run_until_complete(_download(generate_error_page(url)))
 
-            _is_wp = loop.run_until_complete(is_remote_a_wordpress(url, error_page, _download))
+            _is_wp = loop.run_until_complete(is_remote_a_wordpress(url, error_page, _download,
+                                                                   concurrency=concurrency,
+                                                                   homepage_content=homepage))
 
             if not _is_wp:
                 if force_scan is False:
@@ -140,7 +151,8 @@ def find_versions(args):
     if no_check_wordpress_version is False:
             log("[*] Getting WordPress version... ")
 
-            wordpress_version = loop.run_until_complete(get_wordpress_version(url, _download, db))
+            wordpress_version = loop.run_until_complete(get_wordpress_version(url, _download, db,
+                                                                               homepage_content=homepage))
             # wordpress_version.
             if wordpress_version:
                 log("%s (latest: %s)" %
@@ -154,11 +166,8 @@ def find_versions(args):
                 # Looking for CVEs for installed Wordpress version
                 # --------------------------------------------------------------------------
                 if wordpress_version.vulnerabilities:
-                    log("\n    |_CVE list:\n")
-                    for cve in wordpress_version.vulnerabilities:
-                        log("    |__%(cve)s: (http://cve.mitre.org/cgi-bin/cvename.cgi?name=%(cve)s)\n" %
-                            {"cve": colorize(cve, "red")})
-                    log("\n")
+                    log("\n    |_CVE list:\n%s\n" %
+                        "".join([_CVE_LINE.format(cve) for cve in wordpress_version.vulnerabilities]))
             else:
                     log(colorize("Unknown!\n", "red"))
 
@@ -37,21 +37,105 @@
 __all__ = ["is_remote_a_wordpress", "get_wordpress_version"]
 
 import re
+import time
 import asyncio
 
-from urllib.parse import urljoin
+from functools import lru_cache
+from urllib.parse import urljoin, urlparse
 
 from ..db import DB
 from ..wordlist import get_wordlist
 from ..data import PlecostWordPressInfo
-from ..utils import get_diff_ratio, update_progress, download, colorize
+from ..utils import get_diff_ratio, update_progress, colorize
+
+# All these patterns are ASCII and run on raw bytes: only the matched version is decoded
+#
+# Version in generator meta tag (home page) or in readme.html, in only one pass
+_RE_VERSION = re.compile(rb'<meta name="generator" content="WordPress[\s]+(?P<meta>[0-9\.]+)'
+                         rb"|<br[\s]*/>[\s]*[Vv]ersion[\s]*(?P<readme>[\d]\.[\d]\.*[\d]*)")
+# Last version available, from wordpress.org
+_RE_LAST = re.compile(rb"WordPress&nbsp;([0-9\.]*)")
+
+# WordPress fingerprints in the home page. Finding most of them is enough to detect WordPress.
+# Paths only count in links to the target itself: links to other WordPress sites prove nothing
+_FINGERPRINT_PATHS = ("/wp-content/", "/wp-includes/", "/wp-json/")
+_FINGERPRINTS_MIN = 3
+_RE_LINKS = re.compile(rb"""(?:href|src)[\s]*=[\s]*["']?([^"'\s>]+)""", re.IGNORECASE)
+_RE_WORDPRESS = re.compile(rb"wordpress", re.IGNORECASE)
+
+# Seconds to wait for each try of a detection probe. Same as the connection timeout used by find_versions
+_PROBE_TIMEOUT = 10.0
+
+# Last version available doesn't change between scans: remember it for a while
+_LAST_VERSION_TTL = 3600
+_LAST_VERSION_CACHE = {"value": None, "expires": 0.0}
+# Version is near the top of the download page: don't transfer the whole page
+_LAST_VERSION_RANGE = {"Range": "bytes=0-16384"}
+
+# Fallback URLs to get the version from
+_URL_VERSION = (
+    # Generic
+    "wp-login.php",
+
+    # For WordPress 3.8
+    "wp-admin/css/wp-admin-rtl.css",
+    "wp-admin/css/wp-admin.css"
+)
+# Version in any of the fallback URLs: ";ver=X" (wp-login.php) or "Version X" (css)
+_FALLBACK_RE = re.compile(rb"(?:;ver=([0-9\.]+)[\-a-z]*|Version[\s]+([0-9\.]+))")
+
+
+# ----------------------------------------------------------------------
+@lru_cache(maxsize=8)
+def _cached_wordlist(wordlist_name):
+    """
+    Get a word list, reading the file only the first time.
+
+    :param wordlist_name: Word list name
+    :type wordlist_name: basestring
+
+    :return: tuple with each line of file.
+    :rtype: tuple(str)
+    """
+    return tuple(get_wordlist(wordlist_name))
 
 
 # ----------------------------------------------------------------------
 # WordPress testing functions
 # ----------------------------------------------------------------------
-@asyncio.coroutine
-def is_remote_a_wordpress(base_url, error_page, downloader):
+def _homepage_fingerprints(base_url, content):
+    """
+    Get the WordPress fingerprints found in the home page.
+
+    :param base_url: Base url
+    :type base_url: basestring
+
+    :param content: home page raw content
+    :type content: bytes
+
+    :return: set with the fingerprints found.
+    :rtype: set(str)
+    """
+    host = urlparse(base_url).netloc.lower()
+
+    found = set()
+    for link in _RE_LINKS.findall(content):
+        # Relative links are resolved against the target, so they are on the same host
+        link = urlparse(urljoin(base_url, link.decode("latin-1")))
+        if link.netloc.lower() != host:
+            continue
+
+        found.update(x for x in _FINGERPRINT_PATHS if x in link.path)
+
+    if _RE_WORDPRESS.search(content) is not None:
+        found.add("wordpress")
+
+    return found
+
+
+# ----------------------------------------------------------------------
+async def is_remote_a_wordpress(base_url, error_page, downloader, concurrency=32, homepage_content=None,
+                                timeout=_PROBE_TIMEOUT):
     """
     This functions checks if remote host contains a WordPress installation.
 
@@ -61,38 +145,126 @@ def is_remote_a_wordpress(base_url, error_page, downloader):
     :param error_page: error page content
     :type error_page: basestring
 
-    :param downloader: download function. This function must accept only one parameter: the URL
+    :param downloader: download function. It must accept the URL and the 'decode' and 'timeout' keyword parameters
     :type downloader: function
 
+    :param concurrency: maximum number of simultaneous requests against the target
+    :type concurrency: int
+
+    :param homepage_content: home page raw content, if it was already downloaded
+    :type homepage_content: bytes
+
+    :param timeout: seconds to wait for each try of each probe, body included. Probes whose tries all time out
+                    count as not found, so a probe takes at most the downloader's max_tries * timeout seconds
+    :type timeout: float
+
     :return: True if target contains WordPress installation. False otherwise.
     :rtype: bool
     """
-    total_urls = 0
+    # Cheap preflight: look for WordPress fingerprints in the home page
+    if homepage_content is None:
+        # download() returns None when all its tries failed: same as a non-200 response
+        _, status, content = await downloader(base_url, decode=False) or (None, None, None)
+        if status == 200:
+            homepage_content = content
+
+    if homepage_content:
+        if len(_homepage_fingerprints(base_url, homepage_content)) >= _FINGERPRINTS_MIN:
+            return True
+
+    # Home page is inconclusive: probe the wordlist
+    wordlist = _cached_wordlist("wordpress_detection.txt")
+
+    # Producer/consumer: workers keep a constant number of requests in flight
+    pending = asyncio.Queue(maxsize=64)
+    responses = asyncio.Queue()
+
+    async def _produce():
+        for url in wordlist:
+            await pending.put(url)
+
+    async def _work():
+        while True:
+            url = await pending.get()
+
+            # Fix the url for urljoin
+            path = url.lstrip("/")
+
+            try:
+                # Timeout applies to each try, so slow tries are retried by the downloader
+                response = await downloader(urljoin(base_url, path), timeout=timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Failed probe -> not found
+                response = None, None, None
+
+            # download() returns None when all its tries failed -> not found
+            responses.put_nowait(response or (None, None, None))
+
+    tasks = [asyncio.Task(_produce())]
+    # At least one worker, or nobody would answer the consumer
+    tasks.extend(asyncio.Task(_work()) for _ in range(max(1, min(concurrency, len(wordlist)))))
+
+    # Error page size, to discard obviously different pages without diffing them
+    error_page_len = len(error_page or "")
+
+    total_urls = len(wordlist)
+    urls_needed = 0.85 * total_urls
     urls_found = 0
 
-    for url in update_progress(get_wordlist("wordpress_detection.txt"), prefix_text="   "):
-        total_urls += 1
-        # Fix the url for urljoin
-        path = url[1:] if url.startswith("/") else url
+    # Progress bar advances as each probe finishes, not as it's launched
+    progress = update_progress(range(total_urls), prefix_text="   ")
+
+    try:
+        for processed in range(1, total_urls + 1):
+            headers, status, content = await responses.get()
+            next(progress)
 
-        headers, status, content = yield from downloader(urljoin(base_url, path))
+            if status == 200:
+                content_len = len(content or "")
 
-        if status == 200:
+                # The diff ratio can't be greater than 2*min(len)/sum(len): if even that
+                # is below the threshold, pages are different and the diff is not needed
+                if 2.0 * min(content_len, error_page_len) < 0.35 * (content_len + error_page_len):
+                    urls_found += 1
+
+                # Try to detect non-default error pages
+                elif get_diff_ratio(content, error_page) < 0.35:
+                    urls_found += 1
 
-            # Try to detect non-default error pages
-            ratio = get_diff_ratio(content, error_page)
-            if ratio < 0.35:
-                urls_found += 1
+            # Stop as soon as the remaining probes can't change the result
+            if urls_found >= urls_needed or urls_found + (total_urls - processed) < urls_needed:
+                break
+    finally:
+        # Stop the producer and the workers, pending probes are no longer needed
+        for task in tasks:
+            task.cancel()
+
+        # Wait for them to finish, so their connections are released now
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Stopped early: complete the progress bar
+    for _ in progress:
+        pass
 
     # If Oks > 85% continue
-    if (urls_found / float(total_urls)) < 0.85:
-        headers, status, content = yield from downloader(urljoin(base_url, "/wp-admin/"))
-        if status == 302 and "wp-login.php?redirect_to=" in headers.get("location", ""):
-            return True
-        elif status == 301 and "/wp-admin/" in headers.get("location", ""):
-            return True
-        elif status == 200:
+    if urls_found < urls_needed:
+        # download() returns None when all its tries failed: nothing to check
+        headers, status, content = await downloader(urljoin(base_url, "/wp-admin/")) or (None, None, None)
+        if status == 200:
             return True
+
+        # Check where the redirection goes
+        location = headers.get("location") if headers else None
+        if not location:
+            return False
+
+        location = urlparse(location)
+        if status == 302:
+            return location.path.endswith("wp-login.php") and location.query.startswith("redirect_to=")
+        elif status == 301:
+            return location.path.rstrip("/").endswith("/wp-admin")
         else:
             return False
     else:
@@ -100,123 +272,118 @@ def is_remote_a_wordpress(base_url, error_page, downloader):
 
 
 # ----------------------------------------------------------------------
-@asyncio.coroutine
-def get_wordpress_version(url, downloader, db):
+async def _get_last_version(downloader):
+    """
+    Get the last WordPress version available from wordpress.org.
+
+    :param downloader: download function. It must accept the URL and the 'headers' and 'decode' keyword parameters
+    :type downloader: function
+
+    :return: last WordPress version or "unknown" if it can't be found.
+    :rtype: str
+    """
+    # Cached from a previous scan?
+    if _LAST_VERSION_CACHE["value"] is not None and time.monotonic() < _LAST_VERSION_CACHE["expires"]:
+        return _LAST_VERSION_CACHE["value"]
+
+    # URL to get last version of WordPress available
+    try:
+        _, status, last_version_content = await downloader("https://wordpress.org/download/",
+                                                           headers=_LAST_VERSION_RANGE,
+                                                           decode=False)
+
+        last_version = _RE_LAST.search(last_version_content or b"")
+
+        # Not in the first bytes: get the whole page
+        if last_version is None and status == 206:
+            _, _, last_version_content = await downloader("https://wordpress.org/download/", decode=False)
+            last_version = _RE_LAST.search(last_version_content or b"")
+
+        last_version = last_version.group(1).decode("ascii") if last_version else "unknown"
+    except Exception:
+        last_version = "unknown"
+
+    # Only cache real versions, so a network error is retried in the next scan
+    if last_version and last_version != "unknown":
+        _LAST_VERSION_CACHE["value"] = last_version
+        _LAST_VERSION_CACHE["expires"] = time.monotonic() + _LAST_VERSION_TTL
+
+    return last_version
+
+
+# ----------------------------------------------------------------------
+async def get_wordpress_version(url, downloader, db, homepage_content=None):
     """
     This functions checks remote WordPress version.
 
     :param url: site to looking for WordPress version
     :type url: basestring
 
-    :param downloader: download function. This function must accept only one parameter: the URL
+    :param downloader: download function. It must accept the URL and the 'headers' and 'decode' keyword parameters
     :type downloader: function
 
     :param db: cve database instance
     :type db: DB
 
+    :param homepage_content: home page raw content, if it was already downloaded
+    :type homepage_content: bytes
+
     :return: PlecostWordPressInfo instance.
     :rtype: `PlecostWordPressInfo`
     """
-    url_version = {
-        # Generic
-        "wp-login.php": r"(;ver=)([0-9\.]+)([\-a-z]*)",
-
-        # For WordPress 3.8
-        "wp-admin/css/wp-admin-rtl.css": r"(Version[\s]+)([0-9\.]+)",
-        "wp-admin/css/wp-admin.css": r"(Version[\s]+)([0-9\.]+)"
-    }
-
     # --------------------------------------------------------------------------
     #
     # Get installed version:
     #
     # --------------------------------------------------------------------------
 
-    # --------------------------------------------------------------------------
-    # Method 1: Looking for in readme.txt
-    # --------------------------------------------------------------------------
-    headers, status, curr_content = yield from downloader(urljoin(url, "/readme.html"))
-
-    curr_ver = None
-    if curr_content is not None:
-
-        curr_ver = re.search(r"""(<br[\s]*/>[\s]*[Vv]ersion[\s]*)([\d]\.[\d]\.*[\d]*)""", curr_content)
-        if curr_ver is None:
-            curr_ver = None
-        else:
-            if len(curr_ver.groups()) != 2:
-                curr_ver = None
-            else:
-                curr_ver = curr_ver.group(2)
-
-    # --------------------------------------------------------------------------
-    # Method 1: Looking for meta tag
-    # --------------------------------------------------------------------------
-    _, _, curr_content_2 = yield from downloader(url)
-
-    # Try to find the info
-    cur_ver_2 = None
-    if curr_content_2 is not None:
-        cur_ver_2 = re.search(r'''(<meta name=\"generator\" content=\"WordPress[\s]+)([0-9\.]+)''', curr_content_2)
-        if cur_ver_2 is None:
-            cur_ver_2 = None
-        else:
-            if len(cur_ver_2.groups()) != 2:
-                cur_ver_2 = None
-            else:
-                cur_ver_2 = cur_ver_2.group(2)
-
-    # --------------------------------------------------------------------------
-    # Match versions of the different methods
-    # --------------------------------------------------------------------------
-    return_current_version = "unknown"
-    if curr_ver is None and cur_ver_2 is None:
-        return_current_version = "unknown"
-    elif curr_ver is None and cur_ver_2 is not None:
-        return_current_version = cur_ver_2
-    elif curr_ver is not None and cur_ver_2 is None:
-        return_current_version = curr_ver
-    elif curr_ver is not None and cur_ver_2 is not None:
-        if curr_ver != cur_ver_2:
-            return_current_version = cur_ver_2
-        else:
-            return_current_version = curr_ver
-    else:
-        return_current_version = "unknown"
-
-    # If Current version not found
-    if return_current_version == "unknown":
-        for url_pre, regex in url_version.items():
-            # URL to find wordpress version
-            url_current_version = urljoin(url, url_pre)
-            _, _, current_version_content = yield from download(url_current_version, auto_redirect=False)
-
-            # Find the version
-            if current_version_content is not None:
-                tmp_version = re.search(regex, current_version_content)
-
-                if tmp_version is not None:
-                    return_current_version = tmp_version.group(2)
-                    break  # Found -> stop search
-
-    # --------------------------------------------------------------------------
-    # Get last version
-    # --------------------------------------------------------------------------
+    # wordpress.org doesn't depend on the target: get it meanwhile
+    last_version_task = asyncio.Task(_get_last_version(downloader))
 
-    # URL to get last version of WordPress available
     try:
-        _, _, last_version_content = yield from downloader("https://wordpress.org/download/")
-
-        last_version = re.search("(WordPress\&nbsp\;)([0-9\.]*)", str(last_version_content))
-        if last_version is None:
-            last_version = "unknown"
-        else:
-            if len(last_version.groups()) != 2:
-                last_version = "unknown"
-            else:
-                last_version = last_version.group(2)
-    except Exception:
-        last_version = "unknown"
+        # --------------------------------------------------------------------------
+        # Method 1: Looking for meta tag in home page
+        # --------------------------------------------------------------------------
+        if homepage_content is None:
+            # download() returns None when all its tries failed -> no content
+            _, _, homepage_content = await downloader(url, decode=False) or (None, None, None)
+
+        # Only the meta tag is trusted here: "<br/>Version X" in a home page may be any text
+        found = next((x for x in _RE_VERSION.finditer(homepage_content or b"") if x.lastgroup == "meta"), None)
+
+        # --------------------------------------------------------------------------
+        # Method 2: Looking for in readme.html, only if home page has no version
+        # --------------------------------------------------------------------------
+        if found is None:
+            _, _, readme_content = await downloader(urljoin(url, "/readme.html"), decode=False) or (None, None, None)
+
+            found = _RE_VERSION.search(readme_content or b"")
+
+        return_current_version = found.group(found.lastgroup).decode("ascii") if found is not None else "unknown"
+
+        # If Current version not found
+        if return_current_version == "unknown":
+            # Fetch all the candidates at once
+            responses = await asyncio.gather(*[downloader(urljoin(url, url_pre), decode=False)
+                                               for url_pre in _URL_VERSION])
+
+            # download() returns None when all its tries failed -> no content
+            for _, _, current_version_content in (x or (None, None, None) for x in responses):
+
+                # Find the version
+                if current_version_content is not None:
+                    tmp_version = _FALLBACK_RE.search(current_version_content)
+
+                    if tmp_version is not None:
+                        return_current_version = (tmp_version.group(1) or tmp_version.group(2)).decode("ascii")
+                        break  # Found -> stop search
+
+        last_version = await last_version_task
+    finally:
+        # On errors, don't leave the wordpress.org lookup running
+        if not last_version_task.done():
+            last_version_task.cancel()
+            await asyncio.gather(last_version_task, return_exceptions=True)
 
     # Get wordpress vulnerabilities
     return PlecostWordPressInfo(current_version=return_current_version,
@@ -242,8 +409,7 @@ def get_wordpress_vulnerabilities(current_version, db):
     if not isinstance(db, DB):
         raise TypeError("Expected DB, got '%s' instead" % type(db))
 
-    if current_version is "unknown" or \
-            not current_version:
+    if not current_version or current_version == "unknown":
         return []
 
     # Get CVE list
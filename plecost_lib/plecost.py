@@ -279,8 +279,8 @@ if __name__ == "__main__" and __package__ is None:
     __package__ = str("plecost_lib")
 
     # Check Python version
-    if sys.version_info < (3, 3):
-        print("\n[!] You need a Python version greater than 3.3\n")
+    if sys.version_info < (3, 5):
+        print("\n[!] You need a Python version greater than 3.5\n")
         exit(1)
 
     del sys, os